@@ -1,16 +1,29 @@
-from fastapi import FastAPI, APIRouter, HTTPException, status
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Query, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from pymongo import UpdateOne
 import os
+import asyncio
+import json
 import logging
+import random
+import re
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Optional, Dict, Any, Type, Union
 import uuid
+from collections import deque
+from contextvars import ContextVar
 from datetime import datetime
+from functools import lru_cache
+import time
 import bcrypt
+import jwt
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -20,18 +33,339 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# Slow query profiling (opt-in: set SLOW_QUERY_MS to a threshold in milliseconds)
+SLOW_QUERY_MS = float(os.environ['SLOW_QUERY_MS']) if os.environ.get('SLOW_QUERY_MS') else None
+SLOW_QUERY_EXPLAIN_RATE = float(os.environ.get('SLOW_QUERY_EXPLAIN_RATE', 0.1))
+slow_queries = deque(maxlen=int(os.environ.get('SLOW_QUERY_LOG_SIZE', 500)))
+slow_query_logger = logging.getLogger("slow_queries")
+explain_tasks = set()
+# Site of the request being served (set by get_site), so each slow query is attributed to its site
+current_site_id: ContextVar[Optional[str]] = ContextVar("current_site_id", default=None)
+
+def plan_stages(plan):
+    """Yield every stage name found in an explain() winning plan."""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from plan_stages(item)
+
+def query_shape(value):
+    """Replace literal values so that queries differing only by their values group together."""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [query_shape(item) for item in value[:1]]
+    return "?"
+
+class ProfiledCursor:
+    """Wraps a Motor cursor; sort/limit/skip chain, to_list and async iteration are timed.
+
+    Any other cursor method is forwarded to the Motor cursor and returns it unwrapped, so the rest of the chain is not profiled.
+    """
+
+    def __init__(self, collection, cursor, operation, **query):
+        self._collection = collection
+        self._cursor = cursor
+        self._operation = operation
+        self._query = query
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def sort(self, key_or_list, direction=None):
+        # pymongo rejects a direction alongside a list of (key, direction) pairs
+        if direction is None:
+            self._cursor = self._cursor.sort(key_or_list)
+        else:
+            self._cursor = self._cursor.sort(key_or_list, direction)
+        if isinstance(key_or_list, str):
+            self._query["sort"] = {key_or_list: 1 if direction is None else direction}
+        else:
+            self._query["sort"] = dict(key_or_list)
+        return self
+
+    def limit(self, limit):
+        self._cursor = self._cursor.limit(limit)
+        self._query["limit"] = limit
+        return self
+
+    def skip(self, skip):
+        self._cursor = self._cursor.skip(skip)
+        self._query["skip"] = skip
+        return self
+
+    async def to_list(self, length):
+        start = time.perf_counter()
+        documents = await self._cursor.to_list(length)
+        self._collection.record(self._operation, start, len(documents), **self._query)
+        return documents
+
+    async def __aiter__(self):
+        # The duration includes the time the caller spends between documents
+        start = time.perf_counter()
+        count = 0
+        async for document in self._cursor:
+            count += 1
+            yield document
+        self._collection.record(self._operation, start, count, **self._query)
+
+class ProfiledCollection:
+    """Times find, aggregate and update calls and records those above SLOW_QUERY_MS."""
+
+    def __init__(self, collection: AsyncIOMotorCollection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def find(self, filter=None, *args, **kwargs):
+        return ProfiledCursor(self, self._collection.find(filter, *args, **kwargs), "find", filter=filter or {})
+
+    def aggregate(self, pipeline, *args, **kwargs):
+        return ProfiledCursor(self, self._collection.aggregate(pipeline, *args, **kwargs), "aggregate", pipeline=pipeline)
+
+    async def find_one(self, filter=None, *args, **kwargs):
+        start = time.perf_counter()
+        document = await self._collection.find_one(filter, *args, **kwargs)
+        self.record("find_one", start, int(document is not None), filter=filter or {})
+        return document
+
+    async def update_one(self, filter, update, *args, **kwargs):
+        start = time.perf_counter()
+        result = await self._collection.update_one(filter, update, *args, **kwargs)
+        self.record("update", start, result.matched_count, filter=filter, update=update)
+        return result
+
+    async def update_many(self, filter, update, *args, **kwargs):
+        start = time.perf_counter()
+        result = await self._collection.update_many(filter, update, *args, **kwargs)
+        self.record("update", start, result.matched_count, filter=filter, update=update, multi=True)
+        return result
+
+    async def bulk_write(self, requests, *args, **kwargs):
+        start = time.perf_counter()
+        result = await self._collection.bulk_write(requests, *args, **kwargs)
+        self.record("bulk_write", start, result.matched_count, operations=len(requests))
+        return result
+
+    def record(self, operation: str, start: float, count: int, **query):
+        duration_ms = (time.perf_counter() - start) * 1000
+        if duration_ms < SLOW_QUERY_MS:
+            return
+        entry = {
+            "site_id": current_site_id.get(),
+            "collection": self._collection.name,
+            "operation": operation,
+            "duration_ms": round(duration_ms, 2),
+            "count": count,
+            "date": datetime.utcnow(),
+            "plan": None,
+            "collscan": None,
+            **query,
+        }
+        slow_queries.append(entry)
+        # Log the shape, not the literal filter: a batch read-back carries up to BATCH_MAX_ITEMS ids
+        slow_query_logger.warning(
+            "%s.%s took %.1f ms (%d documents) filter=%s sort=%s",
+            entry["collection"], operation, duration_ms, count, query_shape(query["filter"]) if "filter" in query else None, query.get("sort"),
+        )
+        if random.random() < SLOW_QUERY_EXPLAIN_RATE:
+            # explain() runs in the background so the request is not delayed
+            task = asyncio.get_running_loop().create_task(self.capture_plan(entry))
+            explain_tasks.add(task)
+            task.add_done_callback(explain_tasks.discard)
+
+    def explain_command(self, entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        name = self._collection.name
+        if entry["operation"] in ("find", "find_one"):
+            command = {"find": name, "filter": entry["filter"]}
+            for option in ("sort", "limit", "skip"):
+                if entry.get(option):
+                    command[option] = entry[option]
+            if entry["operation"] == "find_one":
+                command["limit"] = 1
+            return command
+        if entry["operation"] == "aggregate":
+            return {"aggregate": name, "pipeline": entry["pipeline"], "cursor": {}}
+        if entry["operation"] == "update":
+            return {"update": name, "updates": [{"q": entry["filter"], "u": entry["update"], "multi": entry.get("multi", False)}]}
+        return None
+
+    async def capture_plan(self, entry: Dict[str, Any]):
+        command = self.explain_command(entry)
+        if command is None:
+            return
+        try:
+            result = await self._collection.database.command({"explain": command, "verbosity": "queryPlanner"})
+        except Exception:
+            slow_query_logger.exception("explain() failed for %s.%s", entry["collection"], entry["operation"])
+            return
+        planner = result.get("queryPlanner")
+        if planner is None:
+            # Aggregations nest the planner output under their first $cursor stage
+            planner = next((stage["$cursor"]["queryPlanner"] for stage in result.get("stages", []) if "$cursor" in stage), {})
+        entry["plan"] = planner.get("winningPlan")
+        entry["collscan"] = "COLLSCAN" in plan_stages(entry["plan"])
+        if entry["collscan"]:
+            slow_query_logger.warning(
+                "%s.%s uses a COLLSCAN filter=%s", entry["collection"], entry["operation"], query_shape(entry.get("filter"))
+            )
+
+class ProfiledDatabase:
+    def __init__(self, database):
+        self._database = database
+
+    def _wrap(self, attribute):
+        return ProfiledCollection(attribute) if isinstance(attribute, AsyncIOMotorCollection) else attribute
+
+    def __getattr__(self, name):
+        return self._wrap(getattr(self._database, name))
+
+    def __getitem__(self, name):
+        return self._wrap(self._database[name])
+
+if SLOW_QUERY_MS is not None:
+    db = ProfiledDatabase(db)
+
+# Multi-site partitioning
+DEFAULT_SITE_ID = os.environ.get('DEFAULT_SITE_ID', 'default')
+SITE_ID_PATTERN = r"^[A-Za-z0-9_-]{1,32}$"
+# Allow-list of the depots served by this deployment: only these sites get tokens and databases
+SITES = [site_id.strip() for site_id in os.environ.get('SITES', DEFAULT_SITE_ID).split(',') if site_id.strip()]
+# shared: all sites live in DB_NAME, separated by site_id; database: one "<DB_NAME>_<site_id>" database per site
+SITE_ROUTING = os.environ.get('SITE_ROUTING', 'shared')
+# Sites moved to their own cluster, e.g. {"depot-nord": "mongodb://nord:27017"}
+SITE_MONGO_URLS = json.loads(os.environ.get('SITE_MONGO_URLS', '{}'))
+
+if SITE_ROUTING not in ("shared", "database"):
+    raise RuntimeError(f"SITE_ROUTING must be 'shared' or 'database', not {SITE_ROUTING!r}")
+if any(not re.fullmatch(SITE_ID_PATTERN, site_id) for site_id in SITES):
+    raise RuntimeError(f"SITES entries must match {SITE_ID_PATTERN}")
+if DEFAULT_SITE_ID not in SITES:
+    raise RuntimeError(f"DEFAULT_SITE_ID {DEFAULT_SITE_ID!r} must be listed in SITES")
+if set(SITE_MONGO_URLS) - set(SITES):
+    raise RuntimeError(f"SITE_MONGO_URLS names sites missing from SITES: {sorted(set(SITE_MONGO_URLS) - set(SITES))}")
+SITE_INDEXES = {
+    "materials": [([("site_id", 1), ("id", 1)], {"unique": True})],
+    "agents": [([("site_id", 1), ("id", 1)], {"unique": True})],
+    "superviseurs": [([("site_id", 1), ("id", 1)], {"unique": True})],
+    "chef_section": [([("site_id", 1), ("id", 1)], {"unique": True})],
+    "demandes_sortie": [
+        ([("site_id", 1), ("id", 1)], {"unique": True}),
+        ([("site_id", 1), ("date", -1)], {}),
+    ],
+}
+mongo_clients = {mongo_url: client}
+
+async def ensure_site_indexes(database):
+    for collection, indexes in SITE_INDEXES.items():
+        for keys, options in indexes:
+            await database[collection].create_index(keys, **options)
+
+def open_site_database(site_id: str):
+    if site_id in SITE_MONGO_URLS:
+        url = SITE_MONGO_URLS[site_id]
+    elif SITE_ROUTING == "database" and site_id != DEFAULT_SITE_ID:
+        url = mongo_url
+    else:
+        # The default site stays on DB_NAME, where documents from before multi-site support live
+        return db
+    if url not in mongo_clients:
+        mongo_clients[url] = AsyncIOMotorClient(url)
+    database = mongo_clients[url][f"{os.environ['DB_NAME']}_{site_id}"]
+    return ProfiledDatabase(database) if SLOW_QUERY_MS is not None else database
+
+# Built once from the allow-list: a token claim can select a database but never create one
+site_databases = {site_id: open_site_database(site_id) for site_id in SITES}
+
+class Site:
+    """Request-scoped tenant: routes query site.db and filter with site.scope()."""
+
+    def __init__(self, site_id: str, database):
+        self.id = site_id
+        self.db = database
+
+    def scope(self, filter: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        # site_id is applied last so a caller-supplied filter can never widen the scope
+        return {**(filter or {}), "site_id": self.id}
+
 # Create the main app
 app = FastAPI()
 
-# Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
-
 # Security
-security = HTTPBearer()
+security = HTTPBearer(auto_error=False)
+
+def required_setting(name: str, hint: str) -> str:
+    value = os.environ.get(name)
+    if not value:
+        raise RuntimeError(f"{name} must be set in the environment or backend/.env ({hint})")
+    return value
+
+JWT_SECRET = required_setting('JWT_SECRET', 'python -c "import secrets; print(secrets.token_hex(32))"')
+JWT_ALGORITHM = "HS256"
+JWT_EXPIRE_MINUTES = int(os.environ.get('JWT_EXPIRE_MINUTES', 12 * 60))
+BCRYPT_HINT = 'python -c "import bcrypt; print(bcrypt.hashpw(b\'<password>\', bcrypt.gensalt()).decode())"'
+ADMIN_PASSWORD_HASH = required_setting('ADMIN_PASSWORD_HASH', BCRYPT_HINT).encode()
+USER_PASSWORD_HASH = required_setting('USER_PASSWORD_HASH', BCRYPT_HINT).encode()
+
+async def check_password(password: str, password_hash: bytes) -> bool:
+    encoded = password.encode()
+    # bcrypt only hashes 72 bytes and newer releases raise on longer input: such a password can't match
+    if len(encoded) > 72:
+        return False
+    # bcrypt is deliberately slow, keep it off the event loop
+    return await run_in_threadpool(bcrypt.checkpw, encoded, password_hash)
+
+def create_token(role: str, site_id: str) -> str:
+    now = int(time.time())
+    claims = {"sub": role, "role": role, "site": site_id, "iat": now, "exp": now + JWT_EXPIRE_MINUTES * 60, "jti": str(uuid.uuid4())}
+    return jwt.encode(claims, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+@lru_cache(maxsize=1024)
+def decode_token(token: str) -> Dict[str, Any]:
+    # Only successful decodes are cached; expiry is re-checked on every request
+    return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM], options={"require": ["exp", "role", "site"]})
+
+async def get_claims(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)) -> Dict[str, Any]:
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="Authentification requise", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        claims = decode_token(credentials.credentials)
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Token invalide", headers={"WWW-Authenticate": "Bearer"})
+    if claims["exp"] <= time.time():
+        raise HTTPException(status_code=401, detail="Token expiré", headers={"WWW-Authenticate": "Bearer"})
+    return claims
+
+async def get_current_role(claims: Dict[str, Any] = Depends(get_claims)) -> str:
+    return claims["role"]
+
+def check_site(site_id: str):
+    if site_id not in site_databases:
+        raise HTTPException(status_code=403, detail="Site inconnu")
+
+async def get_site(claims: Dict[str, Any] = Depends(get_claims)) -> Site:
+    check_site(claims["site"])
+    current_site_id.set(claims["site"])
+    return Site(claims["site"], site_databases[claims["site"]])
+
+async def require_admin(role: str = Depends(get_current_role)) -> str:
+    if role != "admin":
+        raise HTTPException(status_code=403, detail="Accès réservé à l'administrateur")
+    return role
+
+# Create routers with the /api prefix: login is public, everything else needs a token
+auth_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", dependencies=[Depends(get_current_role)])
 
 # Models
 class Material(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    site_id: str = DEFAULT_SITE_ID
     nom: str
     quantite: int
     date_ajout: datetime = Field(default_factory=datetime.utcnow)
@@ -46,6 +380,7 @@ class MaterialUpdate(BaseModel):
 
 class Agent(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    site_id: str = DEFAULT_SITE_ID
     nom: str
     matricule: str
 
@@ -55,6 +390,7 @@ class AgentCreate(BaseModel):
 
 class Superviseur(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    site_id: str = DEFAULT_SITE_ID
     nom: str
     matricule: str
 
@@ -64,6 +400,7 @@ class SuperviseurCreate(BaseModel):
 
 class ChefSection(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    site_id: str = DEFAULT_SITE_ID
     nom: str
     matricule: str
 
@@ -73,6 +410,7 @@ class ChefSectionCreate(BaseModel):
 
 class DemandeSortie(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    site_id: str = DEFAULT_SITE_ID
     superviseur_id: str
     superviseur_nom: str
     superviseur_matricule: str
@@ -94,174 +432,330 @@ class DemandeSortieCreate(BaseModel):
     materiels_demandes: Dict[str, int]
     signature: Optional[str] = None
 
+# Same cap as the list endpoints' to_list(1000)
+BATCH_MAX_ITEMS = 1000
+
+class MaterialBatchItem(BaseModel):
+    id: str
+    nom: Optional[str] = None
+    quantite: Optional[int] = Field(None, ge=0)
+    increment: bool = False  # True: quantite is added to the current stock
+
+    # Checked before anything is written: bulk_write is ordered, so a bad line must not follow applied ones
+    @model_validator(mode="after")
+    def check_update(self):
+        if self.increment and self.quantite is None:
+            raise ValueError("quantite est obligatoire quand increment est activé")
+        if self.nom is None and self.quantite is None:
+            raise ValueError("Aucune donnée à mettre à jour")
+        return self
+
+class MaterialBatchUpdate(BaseModel):
+    items: List[MaterialBatchItem] = Field(..., max_length=BATCH_MAX_ITEMS)
+
+class PersonnelBatchItem(BaseModel):
+    id: str
+    nom: Optional[str] = None
+    matricule: Optional[str] = None
+
+class PersonnelBatchUpdate(BaseModel):
+    items: List[PersonnelBatchItem] = Field(..., max_length=BATCH_MAX_ITEMS)
+
+class BatchDelete(BaseModel):
+    ids: List[str] = Field(..., max_length=BATCH_MAX_ITEMS)
+
 class AdminAuth(BaseModel):
     password: str
+    site_id: str = Field(DEFAULT_SITE_ID, pattern=SITE_ID_PATTERN)
 
-# Admin password (in production, use proper authentication)
-ADMIN_PASSWORD = "admin123"
+class UserAuth(BaseModel):
+    password: str
+    site_id: str = Field(DEFAULT_SITE_ID, pattern=SITE_ID_PATTERN)
+
+# List helpers
+FIELDS_QUERY = Query(None, description="Champs à renvoyer, séparés par des virgules (ex: nom,matricule)")
+FORMAT_QUERY = Query("full", alias="format", pattern="^(full|compact)$", description="full: liste d'objets, compact: colonnes")
+
+def list_response_model(model: Type[BaseModel]):
+    """Response schema of a list endpoint.
+
+    full documents, projected documents (?fields=) or columns (?format=compact: {"id": [...], "nom": [...]})
+    """
+    return Union[List[model], List[Dict[str, Any]], Dict[str, List[Any]]]
+
+def build_projection(fields: Optional[str], model: Type[BaseModel]) -> Optional[Dict[str, int]]:
+    """Translate a ?fields= value into a Mongo projection ("id" is always included)."""
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in model.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Champs inconnus: {', '.join(unknown)}")
+    projection = {"_id": 0, "id": 1}
+    projection.update({field: 1 for field in requested})
+    return projection
+
+async def list_documents(collection, scope: Dict[str, Any], model: Type[BaseModel], fields: Optional[str], response_format: str, sort=None):
+    """Read a collection for a list endpoint, honouring ?fields= and ?format=."""
+    projection = build_projection(fields, model)
+    if projection is None and response_format == "compact":
+        projection = {"_id": 0}
+    cursor = collection.find(scope, projection)
+    if sort:
+        cursor = cursor.sort(*sort)
+    documents = await cursor.to_list(1000)
+
+    if projection is None:
+        return [model(**document) for document in documents]
+
+    # Partial documents don't satisfy the response model, so they are encoded directly
+    if response_format == "compact":
+        names = [name for name in projection if name != "_id"] if fields else list(model.model_fields)
+        columns = {name: [document.get(name) for document in documents] for name in names}
+        return JSONResponse(content=jsonable_encoder(columns))
+    return JSONResponse(content=jsonable_encoder(documents))
+
+# Batch helpers
+async def batch_update(collection, scope: Dict[str, Any], model: Type[BaseModel], updates: List[UpdateOne], ids: List[str]):
+    """Apply updates in a single bulk_write and read the documents back in one query."""
+    if not updates:
+        raise HTTPException(status_code=400, detail="Aucune donnée à mettre à jour")
+    await collection.bulk_write(updates)
+    documents = await collection.find({**scope, "id": {"$in": ids}}).to_list(len(ids))
+    found = {document["id"] for document in documents}
+    return {
+        "updated": [model(**document) for document in documents],
+        "not_found": [item_id for item_id in dict.fromkeys(ids) if item_id not in found],
+    }
+
+def personnel_updates(batch: PersonnelBatchUpdate, site: Site) -> List[UpdateOne]:
+    updates = []
+    for item in batch.items:
+        update_data = item.dict(exclude={"id"}, exclude_none=True)
+        if not update_data:
+            raise HTTPException(status_code=400, detail=f"Aucune donnée à mettre à jour pour {item.id}")
+        updates.append(UpdateOne(site.scope({"id": item.id}), {"$set": update_data}))
+    return updates
+
+async def batch_delete(collection, scope: Dict[str, Any], batch: BatchDelete):
+    if not batch.ids:
+        raise HTTPException(status_code=400, detail="Aucun identifiant fourni")
+    result = await collection.delete_many({**scope, "id": {"$in": batch.ids}})
+    return {"message": f"{result.deleted_count} élément(s) supprimé(s)", "deleted_count": result.deleted_count}
 
 # Routes
 
 # Authentication
-@api_router.post("/login")
+@auth_router.post("/login")
 async def login(auth: AdminAuth):
-    if auth.password == ADMIN_PASSWORD:
-        return {"status": "success", "role": "admin", "token": "admin-token"}
+    check_site(auth.site_id)
+    if await check_password(auth.password, ADMIN_PASSWORD_HASH):
+        return {"status": "success", "role": "admin", "site_id": auth.site_id, "token": create_token("admin", auth.site_id)}
+    else:
+        raise HTTPException(status_code=401, detail="Mot de passe incorrect")
+
+@auth_router.post("/login/user")
+async def login_user(auth: UserAuth):
+    check_site(auth.site_id)
+    if await check_password(auth.password, USER_PASSWORD_HASH):
+        return {"status": "success", "role": "user", "site_id": auth.site_id, "token": create_token("user", auth.site_id)}
     else:
         raise HTTPException(status_code=401, detail="Mot de passe incorrect")
 
 # Materials CRUD
-@api_router.get("/materials", response_model=List[Material])
-async def get_materials():
-    materials = await db.materials.find().to_list(1000)
-    return [Material(**material) for material in materials]
+@api_router.get("/materials", response_model=list_response_model(Material))
+async def get_materials(fields: Optional[str] = FIELDS_QUERY, response_format: str = FORMAT_QUERY, site: Site = Depends(get_site)):
+    return await list_documents(site.db.materials, site.scope(), Material, fields, response_format)
 
-@api_router.post("/materials", response_model=Material)
-async def create_material(material: MaterialCreate):
+@api_router.post("/materials", response_model=Material, dependencies=[Depends(require_admin)])
+async def create_material(material: MaterialCreate, site: Site = Depends(get_site)):
     material_dict = material.dict()
-    material_obj = Material(**material_dict)
-    await db.materials.insert_one(material_obj.dict())
+    material_obj = Material(**material_dict, site_id=site.id)
+    await site.db.materials.insert_one(material_obj.dict())
     return material_obj
 
-@api_router.put("/materials/{material_id}", response_model=Material)
-async def update_material(material_id: str, material_update: MaterialUpdate):
+@api_router.patch("/materials/batch", dependencies=[Depends(require_admin)])
+async def batch_update_materials(batch: MaterialBatchUpdate, site: Site = Depends(get_site)):
+    updates = []
+    for item in batch.items:
+        update = {}
+        if item.nom is not None:
+            update["$set"] = {"nom": item.nom}
+        if item.quantite is not None:
+            if item.increment:
+                update["$inc"] = {"quantite": item.quantite}
+            else:
+                update.setdefault("$set", {})["quantite"] = item.quantite
+        updates.append(UpdateOne(site.scope({"id": item.id}), update))
+    return await batch_update(site.db.materials, site.scope(), Material, updates, [item.id for item in batch.items])
+
+@api_router.delete("/materials/batch", dependencies=[Depends(require_admin)])
+async def batch_delete_materials(batch: BatchDelete, site: Site = Depends(get_site)):
+    return await batch_delete(site.db.materials, site.scope(), batch)
+
+@api_router.put("/materials/{material_id}", response_model=Material, dependencies=[Depends(require_admin)])
+async def update_material(material_id: str, material_update: MaterialUpdate, site: Site = Depends(get_site)):
     update_data = {k: v for k, v in material_update.dict().items() if v is not None}
     if not update_data:
         raise HTTPException(status_code=400, detail="Aucune donnée à mettre à jour")
     
-    result = await db.materials.update_one(
-        {"id": material_id}, 
+    result = await site.db.materials.update_one(
+        site.scope({"id": material_id}), 
         {"$set": update_data}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Matériel non trouvé")
     
-    updated_material = await db.materials.find_one({"id": material_id})
+    updated_material = await site.db.materials.find_one(site.scope({"id": material_id}))
     return Material(**updated_material)
 
-@api_router.delete("/materials/{material_id}")
-async def delete_material(material_id: str):
-    result = await db.materials.delete_one({"id": material_id})
+@api_router.delete("/materials/{material_id}", dependencies=[Depends(require_admin)])
+async def delete_material(material_id: str, site: Site = Depends(get_site)):
+    result = await site.db.materials.delete_one(site.scope({"id": material_id}))
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Matériel non trouvé")
     return {"message": "Matériel supprimé avec succès"}
 
 # Agents CRUD
-@api_router.get("/agents", response_model=List[Agent])
-async def get_agents():
-    agents = await db.agents.find().to_list(1000)
-    return [Agent(**agent) for agent in agents]
+@api_router.get("/agents", response_model=list_response_model(Agent))
+async def get_agents(fields: Optional[str] = FIELDS_QUERY, response_format: str = FORMAT_QUERY, site: Site = Depends(get_site)):
+    return await list_documents(site.db.agents, site.scope(), Agent, fields, response_format)
 
-@api_router.post("/agents", response_model=Agent)
-async def create_agent(agent: AgentCreate):
+@api_router.post("/agents", response_model=Agent, dependencies=[Depends(require_admin)])
+async def create_agent(agent: AgentCreate, site: Site = Depends(get_site)):
     agent_dict = agent.dict()
-    agent_obj = Agent(**agent_dict)
-    await db.agents.insert_one(agent_obj.dict())
+    agent_obj = Agent(**agent_dict, site_id=site.id)
+    await site.db.agents.insert_one(agent_obj.dict())
     return agent_obj
 
-@api_router.put("/agents/{agent_id}", response_model=Agent)
-async def update_agent(agent_id: str, agent_update: AgentCreate):
-    result = await db.agents.update_one(
-        {"id": agent_id}, 
+@api_router.patch("/agents/batch", dependencies=[Depends(require_admin)])
+async def batch_update_agents(batch: PersonnelBatchUpdate, site: Site = Depends(get_site)):
+    return await batch_update(site.db.agents, site.scope(), Agent, personnel_updates(batch, site), [item.id for item in batch.items])
+
+@api_router.delete("/agents/batch", dependencies=[Depends(require_admin)])
+async def batch_delete_agents(batch: BatchDelete, site: Site = Depends(get_site)):
+    return await batch_delete(site.db.agents, site.scope(), batch)
+
+@api_router.put("/agents/{agent_id}", response_model=Agent, dependencies=[Depends(require_admin)])
+async def update_agent(agent_id: str, agent_update: AgentCreate, site: Site = Depends(get_site)):
+    result = await site.db.agents.update_one(
+        site.scope({"id": agent_id}), 
         {"$set": agent_update.dict()}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Agent non trouvé")
     
-    updated_agent = await db.agents.find_one({"id": agent_id})
+    updated_agent = await site.db.agents.find_one(site.scope({"id": agent_id}))
     return Agent(**updated_agent)
 
-@api_router.delete("/agents/{agent_id}")
-async def delete_agent(agent_id: str):
-    result = await db.agents.delete_one({"id": agent_id})
+@api_router.delete("/agents/{agent_id}", dependencies=[Depends(require_admin)])
+async def delete_agent(agent_id: str, site: Site = Depends(get_site)):
+    result = await site.db.agents.delete_one(site.scope({"id": agent_id}))
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Agent non trouvé")
     return {"message": "Agent supprimé avec succès"}
 
 # Superviseurs CRUD
-@api_router.get("/superviseurs", response_model=List[Superviseur])
-async def get_superviseurs():
-    superviseurs = await db.superviseurs.find().to_list(1000)
-    return [Superviseur(**superviseur) for superviseur in superviseurs]
+@api_router.get("/superviseurs", response_model=list_response_model(Superviseur))
+async def get_superviseurs(fields: Optional[str] = FIELDS_QUERY, response_format: str = FORMAT_QUERY, site: Site = Depends(get_site)):
+    return await list_documents(site.db.superviseurs, site.scope(), Superviseur, fields, response_format)
 
-@api_router.post("/superviseurs", response_model=Superviseur)
-async def create_superviseur(superviseur: SuperviseurCreate):
+@api_router.post("/superviseurs", response_model=Superviseur, dependencies=[Depends(require_admin)])
+async def create_superviseur(superviseur: SuperviseurCreate, site: Site = Depends(get_site)):
     superviseur_dict = superviseur.dict()
-    superviseur_obj = Superviseur(**superviseur_dict)
-    await db.superviseurs.insert_one(superviseur_obj.dict())
+    superviseur_obj = Superviseur(**superviseur_dict, site_id=site.id)
+    await site.db.superviseurs.insert_one(superviseur_obj.dict())
     return superviseur_obj
 
-@api_router.put("/superviseurs/{superviseur_id}", response_model=Superviseur)
-async def update_superviseur(superviseur_id: str, superviseur_update: SuperviseurCreate):
-    result = await db.superviseurs.update_one(
-        {"id": superviseur_id}, 
+@api_router.patch("/superviseurs/batch", dependencies=[Depends(require_admin)])
+async def batch_update_superviseurs(batch: PersonnelBatchUpdate, site: Site = Depends(get_site)):
+    return await batch_update(site.db.superviseurs, site.scope(), Superviseur, personnel_updates(batch, site), [item.id for item in batch.items])
+
+@api_router.delete("/superviseurs/batch", dependencies=[Depends(require_admin)])
+async def batch_delete_superviseurs(batch: BatchDelete, site: Site = Depends(get_site)):
+    return await batch_delete(site.db.superviseurs, site.scope(), batch)
+
+@api_router.put("/superviseurs/{superviseur_id}", response_model=Superviseur, dependencies=[Depends(require_admin)])
+async def update_superviseur(superviseur_id: str, superviseur_update: SuperviseurCreate, site: Site = Depends(get_site)):
+    result = await site.db.superviseurs.update_one(
+        site.scope({"id": superviseur_id}), 
         {"$set": superviseur_update.dict()}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Superviseur non trouvé")
     
-    updated_superviseur = await db.superviseurs.find_one({"id": superviseur_id})
+    updated_superviseur = await site.db.superviseurs.find_one(site.scope({"id": superviseur_id}))
     return Superviseur(**updated_superviseur)
 
-@api_router.delete("/superviseurs/{superviseur_id}")
-async def delete_superviseur(superviseur_id: str):
-    result = await db.superviseurs.delete_one({"id": superviseur_id})
+@api_router.delete("/superviseurs/{superviseur_id}", dependencies=[Depends(require_admin)])
+async def delete_superviseur(superviseur_id: str, site: Site = Depends(get_site)):
+    result = await site.db.superviseurs.delete_one(site.scope({"id": superviseur_id}))
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Superviseur non trouvé")
     return {"message": "Superviseur supprimé avec succès"}
 
 # Chef Section CRUD
-@api_router.get("/chef-section", response_model=List[ChefSection])
-async def get_chef_section():
-    chefs = await db.chef_section.find().to_list(1000)
-    return [ChefSection(**chef) for chef in chefs]
+@api_router.get("/chef-section", response_model=list_response_model(ChefSection))
+async def get_chef_section(fields: Optional[str] = FIELDS_QUERY, response_format: str = FORMAT_QUERY, site: Site = Depends(get_site)):
+    return await list_documents(site.db.chef_section, site.scope(), ChefSection, fields, response_format)
 
-@api_router.post("/chef-section", response_model=ChefSection)
-async def create_chef_section(chef: ChefSectionCreate):
+@api_router.post("/chef-section", response_model=ChefSection, dependencies=[Depends(require_admin)])
+async def create_chef_section(chef: ChefSectionCreate, site: Site = Depends(get_site)):
     chef_dict = chef.dict()
-    chef_obj = ChefSection(**chef_dict)
-    await db.chef_section.insert_one(chef_obj.dict())
+    chef_obj = ChefSection(**chef_dict, site_id=site.id)
+    await site.db.chef_section.insert_one(chef_obj.dict())
     return chef_obj
 
-@api_router.put("/chef-section/{chef_id}", response_model=ChefSection)
-async def update_chef_section(chef_id: str, chef_update: ChefSectionCreate):
-    result = await db.chef_section.update_one(
-        {"id": chef_id}, 
+@api_router.patch("/chef-section/batch", dependencies=[Depends(require_admin)])
+async def batch_update_chef_section(batch: PersonnelBatchUpdate, site: Site = Depends(get_site)):
+    return await batch_update(site.db.chef_section, site.scope(), ChefSection, personnel_updates(batch, site), [item.id for item in batch.items])
+
+@api_router.delete("/chef-section/batch", dependencies=[Depends(require_admin)])
+async def batch_delete_chef_section(batch: BatchDelete, site: Site = Depends(get_site)):
+    return await batch_delete(site.db.chef_section, site.scope(), batch)
+
+@api_router.put("/chef-section/{chef_id}", response_model=ChefSection, dependencies=[Depends(require_admin)])
+async def update_chef_section(chef_id: str, chef_update: ChefSectionCreate, site: Site = Depends(get_site)):
+    result = await site.db.chef_section.update_one(
+        site.scope({"id": chef_id}), 
         {"$set": chef_update.dict()}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Chef de section non trouvé")
     
-    updated_chef = await db.chef_section.find_one({"id": chef_id})
+    updated_chef = await site.db.chef_section.find_one(site.scope({"id": chef_id}))
     return ChefSection(**updated_chef)
 
-@api_router.delete("/chef-section/{chef_id}")
-async def delete_chef_section(chef_id: str):
-    result = await db.chef_section.delete_one({"id": chef_id})
+@api_router.delete("/chef-section/{chef_id}", dependencies=[Depends(require_admin)])
+async def delete_chef_section(chef_id: str, site: Site = Depends(get_site)):
+    result = await site.db.chef_section.delete_one(site.scope({"id": chef_id}))
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Chef de section non trouvé")
     return {"message": "Chef de section supprimé avec succès"}
 
 # Demandes de sortie
-@api_router.get("/demandes", response_model=List[DemandeSortie])
-async def get_demandes():
-    demandes = await db.demandes_sortie.find().sort("date", -1).to_list(1000)
-    return [DemandeSortie(**demande) for demande in demandes]
+@api_router.get("/demandes", response_model=list_response_model(DemandeSortie))
+async def get_demandes(fields: Optional[str] = FIELDS_QUERY, response_format: str = FORMAT_QUERY, site: Site = Depends(get_site)):
+    return await list_documents(site.db.demandes_sortie, site.scope(), DemandeSortie, fields, response_format, sort=("date", -1))
+
+@api_router.delete("/demandes/batch", dependencies=[Depends(require_admin)])
+async def batch_delete_demandes(batch: BatchDelete, site: Site = Depends(get_site)):
+    return await batch_delete(site.db.demandes_sortie, site.scope(), batch)
 
 @api_router.post("/demandes", response_model=DemandeSortie)
-async def create_demande(demande_create: DemandeSortieCreate):
+async def create_demande(demande_create: DemandeSortieCreate, site: Site = Depends(get_site)):
     # Get supervisor info
-    superviseur = await db.superviseurs.find_one({"id": demande_create.superviseur_id})
+    superviseur = await site.db.superviseurs.find_one(site.scope({"id": demande_create.superviseur_id}))
     if not superviseur:
         raise HTTPException(status_code=404, detail="Superviseur non trouvé")
     
     # Get agent1 info
-    agent1 = await db.agents.find_one({"id": demande_create.agent1_id})
+    agent1 = await site.db.agents.find_one(site.scope({"id": demande_create.agent1_id}))
     if not agent1:
         raise HTTPException(status_code=404, detail="Agent 1 non trouvé")
     
     # Get agent2 info
-    agent2 = await db.agents.find_one({"id": demande_create.agent2_id})
+    agent2 = await site.db.agents.find_one(site.scope({"id": demande_create.agent2_id}))
     if not agent2:
         raise HTTPException(status_code=404, detail="Agent 2 non trouvé")
     
@@ -276,14 +770,14 @@ async def create_demande(demande_create: DemandeSortieCreate):
         "agent2_matricule": agent2["matricule"]
     })
     
-    demande_obj = DemandeSortie(**demande_dict)
-    await db.demandes_sortie.insert_one(demande_obj.dict())
+    demande_obj = DemandeSortie(**demande_dict, site_id=site.id)
+    await site.db.demandes_sortie.insert_one(demande_obj.dict())
     
     # Update stock quantities
     for material_id, quantite in demande_create.materiels_demandes.items():
         if quantite > 0:
-            await db.materials.update_one(
-                {"id": material_id},
+            await site.db.materials.update_one(
+                site.scope({"id": material_id}),
                 {"$inc": {"quantite": -quantite}}
             )
     
@@ -291,8 +785,8 @@ async def create_demande(demande_create: DemandeSortieCreate):
 
 # Stock alerts
 @api_router.get("/stock-alerts")
-async def get_stock_alerts():
-    materials = await db.materials.find().to_list(1000)
+async def get_stock_alerts(site: Site = Depends(get_site)):
+    materials = await site.db.materials.find(site.scope()).to_list(1000)
     alerts = []
     for material in materials:
         level = "normal"
@@ -309,7 +803,46 @@ async def get_stock_alerts():
         })
     return alerts
 
+# Slow queries
+@api_router.get("/admin/slow-queries", dependencies=[Depends(require_admin)])
+async def get_slow_queries(limit: int = Query(20, ge=1, le=200), site: Site = Depends(get_site)):
+    groups = {}
+    # Plans and filters carry literal ids: an admin only sees the queries of their own site
+    for entry in (entry for entry in slow_queries if entry["site_id"] == site.id):
+        shape = {key: query_shape(entry[key]) for key in ("filter", "sort", "pipeline", "update") if entry.get(key)}
+        key = (entry["collection"], entry["operation"], json.dumps(shape, sort_keys=True))
+        group = groups.setdefault(key, {
+            "collection": entry["collection"],
+            "operation": entry["operation"],
+            "shape": shape,
+            "calls": 0,
+            "total_ms": 0.0,
+            "max_ms": 0.0,
+            "max_count": 0,
+            "collscan": False,
+            "plan": None,
+            "last_seen": None,
+        })
+        group["calls"] += 1
+        group["total_ms"] += entry["duration_ms"]
+        group["max_ms"] = max(group["max_ms"], entry["duration_ms"])
+        group["max_count"] = max(group["max_count"], entry["count"])
+        group["last_seen"] = entry["date"]
+        if entry["plan"] is not None:
+            group["plan"] = entry["plan"]
+            group["collscan"] = group["collscan"] or entry["collscan"]
+
+    worst = sorted(groups.values(), key=lambda group: group["max_ms"], reverse=True)[:limit]
+    for group in worst:
+        group["avg_ms"] = round(group.pop("total_ms") / group["calls"], 2)
+    return {
+        "enabled": SLOW_QUERY_MS is not None,
+        "threshold_ms": SLOW_QUERY_MS,
+        "queries": jsonable_encoder(worst),
+    }
+
 # Include the router in the main app
+app.include_router(auth_router)
 app.include_router(api_router)
 
 app.add_middleware(
@@ -327,6 +860,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def init_site_partitioning():
+    # Documents created before multi-site support belong to the default site
+    if site_databases[DEFAULT_SITE_ID] is db:
+        for collection in SITE_INDEXES:
+            await db[collection].update_many({"site_id": {"$exists": False}}, {"$set": {"site_id": DEFAULT_SITE_ID}})
+    databases = {id(database): database for database in [db, *site_databases.values()]}
+    for database in databases.values():
+        await ensure_site_indexes(database)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    for mongo_client in mongo_clients.values():
+        mongo_client.close()
\ No newline at end of file
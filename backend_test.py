@@ -1,3 +1,4 @@
+import os
 import requests
 import sys
 import uuid
@@ -8,6 +9,8 @@ class StockManagementAPITester:
         self.base_url = base_url
         self.api_url = f"{base_url}/api"
         self.token = None
+        self.admin_password = None
+        self.user_password = os.environ.get("USER_PASSWORD", "user123")
         self.tests_run = 0
         self.tests_passed = 0
         self.created_ids = {
@@ -17,12 +20,13 @@ class StockManagementAPITester:
             "chef_section": []
         }
 
-    def run_test(self, name, method, endpoint, expected_status, data=None, params=None):
-        """Run a single API test"""
+    def run_test(self, name, method, endpoint, expected_status, data=None, params=None, token=None, anonymous=False):
+        """Run a single API test (with the admin token unless another token or anonymous is given)"""
         url = f"{self.api_url}/{endpoint}"
         headers = {'Content-Type': 'application/json'}
-        if self.token:
-            headers['Authorization'] = f'Bearer {self.token}'
+        token = None if anonymous else (token or self.token)
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
 
         self.tests_run += 1
         print(f"\n🔍 Testing {name}...")
@@ -34,8 +38,10 @@ class StockManagementAPITester:
                 response = requests.post(url, json=data, headers=headers)
             elif method == 'PUT':
                 response = requests.put(url, json=data, headers=headers)
+            elif method == 'PATCH':
+                response = requests.patch(url, json=data, headers=headers)
             elif method == 'DELETE':
-                response = requests.delete(url, headers=headers)
+                response = requests.delete(url, json=data, headers=headers)
 
             success = response.status_code == expected_status
             if success:
@@ -69,10 +75,45 @@ class StockManagementAPITester:
         )
         if success and 'token' in response:
             self.token = response['token']
+            self.admin_password = password
             print(f"Admin login successful, token: {self.token}")
             return True
         return False
 
+    def test_auth(self):
+        """Test token checks and admin-only routes"""
+        print("\n=== Testing Authorization ===")
+
+        checks = [
+            self.run_test("Wrong Admin Password", "POST", "login", 401, data={"password": "wrong-password"}, anonymous=True)[0],
+            self.run_test("Materials without Token", "GET", "materials", 401, anonymous=True)[0],
+            self.run_test("Materials with Invalid Token", "GET", "materials", 401, token="not-a-jwt")[0],
+            self.run_test("Admin Password over 72 Bytes", "POST", "login", 401, data={"password": "x" * 100}, anonymous=True)[0],
+            self.run_test("User Login without Password", "POST", "login/user", 422, data={}, anonymous=True)[0],
+            self.run_test("Wrong User Password", "POST", "login/user", 401, data={"password": "wrong-password"}, anonymous=True)[0],
+        ]
+
+        user_token = self.login_user()
+        if not user_token:
+            return False
+
+        checks += [
+            self.run_test("Materials as User", "GET", "materials", 200, token=user_token)[0],
+            self.run_test("Create Material as User", "POST", "materials", 403,
+                          data={"nom": "Forbidden", "quantite": 1}, token=user_token)[0],
+            self.run_test("Batch Update as User", "PATCH", "materials/batch", 403,
+                          data={"items": [{"id": "x", "quantite": 1}]}, token=user_token)[0],
+            self.run_test("Batch Delete Agents as User", "DELETE", "agents/batch", 403,
+                          data={"ids": ["x"]}, token=user_token)[0],
+        ]
+        return all(checks)
+
+    def login_user(self, name="User Login"):
+        """Log in as a user and return the token (None on failure)"""
+        success, response = self.run_test(name, "POST", "login/user", 200,
+                                          data={"password": self.user_password}, anonymous=True)
+        return response.get('token') if success else None
+
     def test_materials_crud(self):
         """Test CRUD operations for materials"""
         print("\n=== Testing Materials CRUD ===")
@@ -119,6 +160,161 @@ class StockManagementAPITester:
             return True
         return False
 
+    def test_list_projection(self):
+        """Test ?fields= projection and ?format=compact on list endpoints"""
+        print("\n=== Testing List Projection ===")
+
+        for i in range(2):
+            success, created = self.run_test(
+                f"Create Material {i + 1} for Projection",
+                "POST",
+                "materials",
+                200,
+                data={"nom": f"Projection Material {uuid.uuid4().hex[:8]}", "quantite": 20}
+            )
+            if success and 'id' in created:
+                self.created_ids["materials"].append(created['id'])
+
+        success, materials = self.run_test(
+            "Get Materials with fields=nom",
+            "GET",
+            "materials",
+            200,
+            params={"fields": "nom"}
+        )
+        if not success or not materials:
+            return False
+        extra = [set(material) - {"id", "nom"} for material in materials if set(material) - {"id", "nom"}]
+        if extra:
+            print(f"❌ Unexpected fields returned: {extra[0]}")
+            return False
+        print("✅ Only id and nom returned")
+
+        success, columns = self.run_test(
+            "Get Materials in compact format",
+            "GET",
+            "materials",
+            200,
+            params={"fields": "nom,quantite", "format": "compact"}
+        )
+        if not success:
+            return False
+        if set(columns) != {"id", "nom", "quantite"} or len({len(values) for values in columns.values()}) != 1:
+            print(f"❌ Unexpected compact response: {columns}")
+            return False
+        print(f"✅ Compact response has {len(columns['id'])} rows")
+
+        success, _ = self.run_test(
+            "Get Materials with unknown field",
+            "GET",
+            "materials",
+            400,
+            params={"fields": "inconnu"}
+        )
+        return success
+
+    def test_batch_operations(self):
+        """Test batch update and delete endpoints"""
+        print("\n=== Testing Batch Operations ===")
+
+        material_ids = []
+        for i in range(2):
+            success, created = self.run_test(
+                f"Create Material {i + 1} for Batch",
+                "POST",
+                "materials",
+                200,
+                data={"nom": f"Batch Material {uuid.uuid4().hex[:8]}", "quantite": 10}
+            )
+            if not success or 'id' not in created:
+                return False
+            material_ids.append(created['id'])
+
+        missing_id = str(uuid.uuid4())
+        success, result = self.run_test(
+            "Batch Restock Materials",
+            "PATCH",
+            "materials/batch",
+            200,
+            data={"items": [
+                {"id": material_ids[0], "quantite": 5, "increment": True},
+                {"id": material_ids[1], "quantite": 42},
+                {"id": missing_id, "quantite": 1},
+            ]}
+        )
+        if not success:
+            return False
+        quantities = {material["id"]: material["quantite"] for material in result["updated"]}
+        if quantities != {material_ids[0]: 15, material_ids[1]: 42} or result["not_found"] != [missing_id]:
+            print(f"❌ Unexpected batch result: {result}")
+            return False
+        print("✅ Quantities updated and missing id reported")
+
+        success, _ = self.run_test(
+            "Batch Increment without Quantity",
+            "PATCH",
+            "materials/batch",
+            422,
+            data={"items": [{"id": material_ids[0], "quantite": 1}, {"id": material_ids[1], "increment": True}]}
+        )
+        if not success:
+            return False
+
+        success, _ = self.run_test(
+            "Batch Negative Quantity",
+            "PATCH",
+            "materials/batch",
+            422,
+            data={"items": [{"id": material_ids[0], "quantite": -3}]}
+        )
+        if not success:
+            return False
+
+        success, _ = self.run_test(
+            "Oversized Batch",
+            "PATCH",
+            "materials/batch",
+            422,
+            data={"items": [{"id": material_ids[0], "quantite": 1}] * 1001}
+        )
+        if not success:
+            return False
+
+        success, _ = self.run_test(
+            "Oversized Batch Delete",
+            "DELETE",
+            "materials/batch",
+            422,
+            data={"ids": [str(uuid.uuid4()) for _ in range(1001)]}
+        )
+        if not success:
+            return False
+
+        success, materials = self.run_test(
+            "Check Rejected Batch Was Not Applied",
+            "GET",
+            "materials",
+            200,
+            params={"fields": "quantite"}
+        )
+        current = {material["id"]: material["quantite"] for material in materials}
+        if current.get(material_ids[0]) != 15:
+            print(f"❌ Rejected batch modified stock: {current.get(material_ids[0])}")
+            return False
+
+        success, result = self.run_test(
+            "Batch Delete Materials",
+            "DELETE",
+            "materials/batch",
+            200,
+            data={"ids": material_ids + [missing_id]}
+        )
+        if not success or result.get("deleted_count") != 2:
+            print(f"❌ Unexpected delete result: {result}")
+            return False
+        print("✅ Batch delete removed 2 materials")
+        return True
+
     def test_agents_crud(self):
         """Test CRUD operations for agents"""
         print("\n=== Testing Agents CRUD ===")
@@ -408,17 +604,94 @@ class StockManagementAPITester:
         
         return False
 
+    def test_sites(self, second_site=None):
+        """Test the site allow-list, and cross-site isolation when second_site (listed in the server's SITES) is given"""
+        print("\n=== Testing Sites ===")
+
+        unknown_site = f"inconnu-{uuid.uuid4().hex[:8]}"
+        checks = [
+            self.run_test("User Login on Unknown Site", "POST", "login/user", 403,
+                          data={"password": self.user_password, "site_id": unknown_site}, anonymous=True)[0],
+            self.run_test("Admin Login on Unknown Site", "POST", "login", 403,
+                          data={"password": self.admin_password, "site_id": unknown_site}, anonymous=True)[0],
+        ]
+        if not all(checks):
+            return False
+
+        if not second_site:
+            print("⚠️ Cross-site isolation skipped: set SECOND_SITE_ID to a second site listed in the server's SITES")
+            return True
+
+        success, response = self.run_test(f"Admin Login on {second_site}", "POST", "login", 200,
+                                          data={"password": self.admin_password, "site_id": second_site}, anonymous=True)
+        if not success:
+            print(f"❌ Site {second_site} must be listed in the server's SITES to test isolation")
+            return False
+        second_token = response['token']
+
+        material_name = f"Site Material {uuid.uuid4().hex[:8]}"
+        success, created = self.run_test(f"Create Material on {second_site}", "POST", "materials", 200,
+                                         data={"nom": material_name, "quantite": 7}, token=second_token)
+        if not success:
+            return False
+
+        success, materials = self.run_test("Get Materials on Default Site", "GET", "materials", 200)
+        if not success or any(material["id"] == created["id"] for material in materials):
+            print(f"❌ Material from {second_site} is visible on the default site")
+            return False
+
+        checks = [
+            self.run_test(f"Update {second_site} Material from Default Site", "PUT",
+                          f"materials/{created['id']}", 404, data={"quantite": 0})[0],
+            self.run_test(f"Delete {second_site} Material from Default Site", "DELETE",
+                          f"materials/{created['id']}", 404)[0],
+        ]
+        success, materials = self.run_test(f"Get Materials on {second_site}", "GET", "materials", 200, token=second_token)
+        if not success or [material["id"] for material in materials if material["nom"] == material_name] != [created["id"]]:
+            print(f"❌ Material missing on {second_site}")
+            return False
+
+        # The default site has queried agents, superviseurs and demandes; none of that may show up here
+        success, summary = self.run_test(f"Slow Queries on {second_site}", "GET", "admin/slow-queries", 200, token=second_token)
+        if not success or any(query["collection"] != "materials" for query in summary["queries"]):
+            print(f"❌ Slow queries from another site are visible on {second_site}")
+            return False
+        print("✅ Sites are isolated")
+
+        self.run_test(f"Cleanup {second_site} Material", "DELETE", f"materials/{created['id']}", 200, token=second_token)
+        return all(checks)
+
+    def test_slow_queries(self):
+        """Test the slow query summary endpoint"""
+        print("\n=== Testing Slow Queries ===")
+
+        user_token = self.login_user("User Login for Slow Queries")
+        if not user_token:
+            return False
+        success_user, _ = self.run_test("Slow Queries as User", "GET", "admin/slow-queries", 403, token=user_token)
+
+        success, summary = self.run_test("Slow Queries as Admin", "GET", "admin/slow-queries", 200, params={"limit": 5})
+        if not success or not {"enabled", "threshold_ms", "queries"} <= set(summary) or len(summary["queries"]) > 5:
+            print(f"❌ Unexpected slow query summary: {summary}")
+            return False
+        print(f"✅ Profiling enabled: {summary['enabled']}, {len(summary['queries'])} query shapes")
+        return success_user
+
 def main():
     # Setup
-    tester = StockManagementAPITester()
+    tester = StockManagementAPITester(os.environ["BACKEND_URL"]) if "BACKEND_URL" in os.environ else StockManagementAPITester()
     
     # Run tests
     if not tester.test_login():
         print("❌ Login failed, stopping tests")
         return 1
 
+    tester.test_auth()
+
     # Test all CRUD operations
     tester.test_materials_crud()
+    tester.test_list_projection()
+    tester.test_batch_operations()
     tester.test_agents_crud()
     tester.test_superviseurs_crud()
     tester.test_chef_section_crud()
@@ -426,6 +699,8 @@ def main():
     # Test demandes and stock alerts
     tester.test_demandes()
     tester.test_stock_alerts()
+    tester.test_slow_queries()
+    tester.test_sites(os.environ.get("SECOND_SITE_ID"))
 
     # Print results
     print(f"\n📊 Tests passed: {tester.tests_passed}/{tester.tests_run}")
@@ -5,6 +5,30 @@ import axios from "axios";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+const SITE_ID = process.env.REACT_APP_SITE_ID || 'default';
+
+// Attach the session token to every API call; a single key so admin and user sessions never overlap
+axios.interceptors.request.use((config) => {
+  const token = localStorage.getItem('token');
+  if (token) {
+    config.headers.Authorization = `Bearer ${token}`;
+  }
+  return config;
+});
+
+// Expired or rejected token: drop it and go back to the access choice
+axios.interceptors.response.use(
+  (response) => response,
+  (error) => {
+    if (error.response && error.response.status === 401 && !error.config.url.includes('/login')) {
+      localStorage.removeItem('token');
+      if (window.location.pathname !== '/') {
+        window.location.assign('/');
+      }
+    }
+    return Promise.reject(error);
+  }
+);
 
 // Login Page Component
 const LoginPage = () => {
@@ -15,7 +39,7 @@ const LoginPage = () => {
   };
 
   const handleUserAccess = () => {
-    navigate('/home');
+    navigate('/user-login');
   };
 
   return (
@@ -61,9 +85,9 @@ const AdminLogin = () => {
   const handleLogin = async (e) => {
     e.preventDefault();
     try {
-      const response = await axios.post(`${API}/login`, { password });
+      const response = await axios.post(`${API}/login`, { password, site_id: SITE_ID });
       if (response.data.status === 'success') {
-        localStorage.setItem('admin-token', response.data.token);
+        localStorage.setItem('token', response.data.token);
         navigate('/admin');
       }
     } catch (error) {
@@ -118,6 +142,72 @@ const AdminLogin = () => {
   );
 };
 
+// User Login Component
+const UserLogin = () => {
+  const [password, setPassword] = useState('');
+  const [error, setError] = useState('');
+  const navigate = useNavigate();
+
+  const handleLogin = async (e) => {
+    e.preventDefault();
+    try {
+      const response = await axios.post(`${API}/login/user`, { password, site_id: SITE_ID });
+      if (response.data.status === 'success') {
+        localStorage.setItem('token', response.data.token);
+        navigate('/home');
+      }
+    } catch (error) {
+      setError('Mot de passe incorrect');
+    }
+  };
+
+  return (
+    <div className="min-h-screen bg-gradient-to-br from-blue-900 to-purple-900 flex items-center justify-center">
+      <div className="bg-white rounded-lg shadow-2xl p-8 w-96">
+        <div className="text-center mb-8">
+          <h1 className="text-2xl font-bold text-gray-800 mb-2">Connexion Utilisateur</h1>
+        </div>
+        
+        <form onSubmit={handleLogin} className="space-y-4">
+          <div>
+            <label className="block text-gray-700 text-sm font-bold mb-2">
+              Mot de passe
+            </label>
+            <input
+              type="password"
+              value={password}
+              onChange={(e) => setPassword(e.target.value)}
+              className="w-full px-3 py-2 border border-gray-300 rounded-lg focus:outline-none focus:ring-2 focus:ring-blue-500"
+              placeholder="Entrez le mot de passe"
+              required
+            />
+          </div>
+          
+          {error && (
+            <div className="text-red-500 text-sm text-center">{error}</div>
+          )}
+          
+          <button
+            type="submit"
+            className="w-full bg-blue-600 hover:bg-blue-700 text-white font-bold py-3 px-4 rounded-lg transition duration-200"
+          >
+            Se connecter
+          </button>
+        </form>
+        
+        <div className="text-center mt-4">
+          <button
+            onClick={() => navigate('/')}
+            className="text-gray-600 hover:text-gray-800 text-sm"
+          >
+            Retour
+          </button>
+        </div>
+      </div>
+    </div>
+  );
+};
+
 // Home Page Component
 const HomePage = () => {
   const [materials, setMaterials] = useState([]);
@@ -415,7 +505,7 @@ const AdminDashboard = () => {
             <h1 className="text-3xl font-bold text-gray-900">Administration</h1>
             <button
               onClick={() => {
-                localStorage.removeItem('admin-token');
+                localStorage.removeItem('token');
                 window.location.href = '/';
               }}
               className="bg-red-600 hover:bg-red-700 text-white font-bold py-2 px-4 rounded-lg"
@@ -522,9 +612,9 @@ const MaterialRequestPage = () => {
   const fetchData = async () => {
     try {
       const [agentsRes, superviseursRes, materialsRes] = await Promise.all([
-        axios.get(`${API}/agents`),
-        axios.get(`${API}/superviseurs`),
-        axios.get(`${API}/materials`)
+        axios.get(`${API}/agents`, { params: { fields: 'nom,matricule' } }),
+        axios.get(`${API}/superviseurs`, { params: { fields: 'nom,matricule' } }),
+        axios.get(`${API}/materials`, { params: { fields: 'nom,quantite' } })
       ]);
       
       setAgents(agentsRes.data);
@@ -698,6 +788,7 @@ function App() {
         <Routes>
           <Route path="/" element={<LoginPage />} />
           <Route path="/admin-login" element={<AdminLogin />} />
+          <Route path="/user-login" element={<UserLogin />} />
           <Route path="/home" element={<HomePage />} />
           <Route path="/admin" element={<AdminDashboard />} />
           <Route path="/demande" element={<MaterialRequestPage />} />